@@ -1,22 +1,40 @@
 """
 Aggregate queries
 """
-from datetime import datetime
-from typing import Mapping, Iterable, Union, Tuple, Sequence, List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date
+from typing import Mapping, Iterable, Union, Tuple, Sequence, List, Dict, Optional, Callable, Any
 
 from amcat4.date_mappings import interval_mapping
-from amcat4.elastic import es, get_fields
+from amcat4.elastic import es, get_fields, get_date_mapping_fields
 from amcat4.query import build_body, _normalize_queries
 
 
-def _combine_mappings(mappings):
-    result = {}
-    for mapping in mappings:
-        if mapping:
-            result.update(mapping)
+def _combine_mappings(mappings: Iterable[Optional[dict]]) -> Optional[dict]:
+    """Combine the (non-empty) runtime mappings into a single dict, or return None if there are none"""
+    non_empty = (m for m in mappings if m)
+    first = next(non_empty, None)
+    if first is None:
+        return None
+    result = dict(first)
+    for mapping in non_empty:
+        result.update(mapping)
     return result
 
 
+def _timestamp_to_datetime(value):
+    return datetime.utcfromtimestamp(value / 1000.)
+
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_MS_PER_DAY = 24 * 60 * 60 * 1000
+
+
+def _timestamp_to_date(value):
+    # Same as datetime.utcfromtimestamp(value / 1000.).date(), but without creating the intermediate datetime
+    return date.fromordinal(_EPOCH_ORDINAL + value // _MS_PER_DAY)
+
+
 class Axis:
     """
     Class that specifies an aggregation axis
@@ -25,6 +43,8 @@ class Axis:
         self.field = field
         self.interval = interval
         self.ftype = field_type
+        # Is the date mapping for the interval persisted in the index (see DateMapping.persist)?
+        self.persisted = False
         if name:
             self.name = name
         elif interval:
@@ -48,21 +68,21 @@ class Axis:
         else:
             return {self.name: {"terms": {"field": self.field}}}
 
-    def get_value(self, values):
-        value = values[self.name]
+    def converter(self) -> Optional[Callable[[Any], Any]]:
+        """Get the function to convert raw elastic values for this axis, or None if no conversion is needed"""
         if m := interval_mapping(self.interval):
-            value = m.postprocess(value)
+            return m.postprocess
         elif self.ftype == "date":
-            value = datetime.utcfromtimestamp(value / 1000.)
             if self.interval in {"year", "month", "week", "day"}:
-                value = value.date()
-        return value
+                return _timestamp_to_date
+            return _timestamp_to_datetime
+        return None
 
     def asdict(self):
         return {"name": self.name, "field": self.field, "type": self.ftype, "interval": self.interval}
 
     def runtime_mappings(self):
-        if m := interval_mapping(self.interval):
+        if (m := interval_mapping(self.interval)) and not self.persisted:
             return m.mapping(self.field)
 
 
@@ -75,14 +95,21 @@ class Aggregation:
         self.function = function
         self.name = name or f"{function}_{field}"
         self.ftype = ftype
+        self._dsl_item = (self.name, {self.function: {"field": self.field}})
 
     def dsl_item(self):
-        return self.name, {self.function: {"field": self.field}}
+        return self._dsl_item
+
+    def converter(self) -> Optional[Callable[[Any], Any]]:
+        """Get the function to convert raw elastic values for this aggregation, or None if no conversion is needed"""
+        if self.ftype == "date":
+            return lambda value: _timestamp_to_datetime(value) if value else value
+        return None
 
     def get_value(self, bucket: dict):
         result = bucket[self.name]['value']
-        if result and self.ftype == "date":
-            result = datetime.utcfromtimestamp(result / 1000.)
+        if convert := self.converter():
+            result = convert(result)
         return result
 
     def asdict(self):
@@ -111,74 +138,160 @@ class AggregateResult:
             yield dict(zip(keys, row))
 
 
-def _bare_aggregate(index: str, queries, filters, aggregations: Sequence[Aggregation]) -> Tuple[int, dict]:
+def _bare_aggregate(index: str, queries: Sequence[str], filters,
+                    aggregations: Sequence[Aggregation]) -> Tuple[int, dict]:
     """
     Aggregate without sources/group_by.
     Returns a tuple of doc count and aggregegations (doc_count, {metric: value})
     """
     body = build_body(queries=queries, filters=filters) if filters or queries else {}
-    aresult = es().search(index=index, size=0, aggregations=aggregation_dsl(aggregations), **body)
-    cresult = es().count(index=index, **body)
-    return cresult['count'], aresult['aggregations']
+    result = es().search(index=index, size=0, track_total_hits=True, aggregations=aggregation_dsl(aggregations), **body)
+    return result['hits']['total']['value'], result['aggregations']
 
 
-def _elastic_aggregate(index: Union[str, List[str]], sources, queries, filters, aggregations: Sequence[Aggregation],
-                       runtime_mappings: Mapping[str, Mapping] = None, after_key=None) -> Iterable[dict]:
-    """
-    Recursively get all buckets from a composite query.
-    Yields 'buckets' consisting of {key: {axis: value}, doc_count: <number>}
-    """
-    # [WvA] Not sure if we should get all results ourselves or expose the 'after' pagination.
-    #       This might get us in trouble if someone e.g. aggregates on url or day for a large corpus
+def _composite_dsl(sources, aggregations: Sequence[Aggregation], after_key=None) -> dict:
+    """Get the composite aggregation DSL for the given sources and (optional) metric aggregations"""
     after = {"after": after_key} if after_key else {}
     aggr: Dict[str, Dict[str, dict]] = {"aggs": {"composite": dict(sources=sources, **after)}}
     if aggregations:
         aggr["aggs"]['aggregations'] = aggregation_dsl(aggregations)
+    return aggr
+
+
+def _check_failures(result: dict):
+    if failure := result.get("_shards", {}).get("failures"):
+        raise Exception(f'Error on running aggregate search: {failure}')
+
+
+def _elastic_aggregate(index: Union[str, List[str]], sources, queries: Sequence[str], filters,
+                       aggregations: Sequence[Aggregation],
+                       runtime_mappings: Mapping[str, Mapping] = None, after_key=None) -> Iterable[List[dict]]:
+    """
+    Get all buckets from a composite query, requesting pages until there is no after_key.
+    Yields pages (lists) of 'buckets' consisting of {key: {axis: value}, doc_count: <number>}
+    """
+    # [WvA] Not sure if we should get all results ourselves or expose the 'after' pagination.
+    #       This might get us in trouble if someone e.g. aggregates on url or day for a large corpus
+    # The query and aggregation are the same for every page, only the 'after' key of the composite changes
+    aggr = _composite_dsl(sources, aggregations, after_key)
     kargs = {}
     if filters or queries:
-        q = build_body(queries=queries.values(), filters=filters)
+        q = build_body(queries=queries, filters=filters)
         kargs["query"] = q["query"]
-    result = es().search(index=index if isinstance(index, str) else ",".join(index),
-                         size=0, aggregations=aggr, runtime_mappings=runtime_mappings, **kargs
-                         )
-    if failure := result.get("_shards", {}).get("failures"):
-        raise Exception(f'Error on running aggregate search: {failure}')
-    yield from result['aggregations']['aggs']['buckets']
-    after_key = result['aggregations']['aggs'].get('after_key')
-    if after_key:
-        yield from _elastic_aggregate(index, sources, queries, filters, aggregations,
-                                      runtime_mappings=runtime_mappings, after_key=after_key)
+    index = index if isinstance(index, str) else ",".join(index)
+
+    def search() -> dict:
+        result = es().search(index=index, size=0, aggregations=aggr, runtime_mappings=runtime_mappings, **kargs)
+        _check_failures(result)
+        return result['aggregations']['aggs']
+
+    # Request the next page in the background while the caller processes the current page
+    # (the executor only starts a thread if there is a second page)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        page = search()
+        while True:
+            next_page = None
+            if after_key := page.get('after_key'):
+                aggr["aggs"]["composite"]["after"] = after_key
+                next_page = executor.submit(search)
+            yield page['buckets']
+            if next_page is None:
+                break
+            page = next_page.result()
+
+
+def _convert_column(convert: Optional[Callable[[Any], Any]], values: List) -> List:
+    return list(map(convert, values)) if convert else values
+
+
+def _bucket_rows(axes: Sequence[Axis], aggregations: Sequence[Aggregation], buckets: List[dict]) -> Iterable[tuple]:
+    """
+    Convert a page of composite buckets into result tuples (axis1, ..., n, aggregation1, ...)
+    Values are collected and converted per column, so the conversion for each axis is only determined once
+    """
+    columns = [_convert_column(axis.converter(), [b['key'][axis.name] for b in buckets]) for axis in axes]
+    columns.append([b['doc_count'] for b in buckets])
+    for a in aggregations:
+        columns.append(_convert_column(a.converter(), [b[a.name]['value'] for b in buckets]))
+    return zip(*columns)
+
+
+def _msearch_aggregate(index: Union[str, List[str]], axes: List[Axis], queries: Mapping[str, str],
+                       filters: Optional[Mapping[str, Mapping]],
+                       aggregations: List[Aggregation]) -> Iterable[Tuple[str, tuple]]:
+    """
+    Run the aggregation separately for each query, requesting the first page for all queries in a single msearch.
+    Queries with more composite pages are completed with normal searches afterwards.
+    Yields (label, result_tuple) pairs
+    """
+    if not queries:
+        return
+    index = index if isinstance(index, str) else ",".join(index)
+    sources, runtime_mappings = None, None
+    # The aggregation DSL is the same for each query, so only build it once
+    if axes:
+        sources = [axis.query() for axis in axes]
+        runtime_mappings = _combine_mappings(axis.runtime_mappings() for axis in axes)
+        aggr = _composite_dsl(sources, aggregations)
+    else:
+        aggr = aggregation_dsl(aggregations)
+    searches: List[dict] = []
+    for query in queries.values():
+        body = build_body(queries=[query], filters=filters)
+        if axes:
+            search = dict(size=0, query=body["query"], aggregations=aggr)
+            if runtime_mappings:
+                search["runtime_mappings"] = runtime_mappings
+        else:
+            search = dict(size=0, track_total_hits=True, **body)
+            if aggr:
+                search["aggregations"] = aggr
+        searches += [{"index": index}, search]
+    responses = es().msearch(searches=searches)['responses']
+    for (label, query), result in zip(queries.items(), responses):
+        if error := result.get("error"):
+            raise Exception(f'Error on running aggregate search: {error}')
+        _check_failures(result)
+        if not axes:
+            row = (result['hits']['total']['value'], )
+            if aggregations:
+                row += tuple(a.get_value(result['aggregations']) for a in aggregations)
+            yield label, row
+            continue
+        for row in _bucket_rows(axes, aggregations, result['aggregations']['aggs']['buckets']):
+            yield label, row
+        if after_key := result['aggregations']['aggs'].get('after_key'):
+            for buckets in _elastic_aggregate(index, sources, [query], filters, aggregations,
+                                              runtime_mappings=runtime_mappings, after_key=after_key):
+                for row in _bucket_rows(axes, aggregations, buckets):
+                    yield label, row
 
 
 def _aggregate_results(index: Union[str, List[str]], axes: List[Axis], queries: Mapping[str, str],
                        filters: Optional[Mapping[str, Mapping]], aggregations: List[Aggregation]) -> Iterable[tuple]:
+    query_values = list(queries.values())
     if not axes:
         # No axes, so return aggregations (or total count) only
         if aggregations:
-            count, results = _bare_aggregate(index, queries, filters, aggregations)
+            count, results = _bare_aggregate(index, query_values, filters, aggregations)
             yield (count,) + tuple(a.get_value(results) for a in aggregations)
         else:
-            result = es().count(index=index if isinstance(index, str) else ",".join(index),
-                                **build_body(queries=queries, filters=filters))
-            yield result['count'],
+            result = es().search(index=index if isinstance(index, str) else ",".join(index),
+                                 size=0, track_total_hits=True, **build_body(queries=query_values, filters=filters))
+            yield result['hits']['total']['value'],
     elif any(ax.field == "_query" for ax in axes):
         # Strip off _query axis and run separate aggregation for each query
         i = [ax.field for ax in axes].index("_query")
         _axes = axes[:i] + axes[(i+1):]
-        for label, query in queries.items():
-            for result_tuple in _aggregate_results(index, _axes, {label: query}, filters, aggregations):
-                # insert label into the right position on the result tuple
-                yield result_tuple[:i] + (label,) + result_tuple[i:]
+        for label, result_tuple in _msearch_aggregate(index, _axes, queries, filters, aggregations):
+            # insert label into the right position on the result tuple
+            yield result_tuple[:i] + (label,) + result_tuple[i:]
     else:
         # Run an aggregation with one or more axes
         sources = [axis.query() for axis in axes]
         runtime_mappings = _combine_mappings(axis.runtime_mappings() for axis in axes)
-        for bucket in _elastic_aggregate(index, sources, queries, filters, aggregations, runtime_mappings):
-            row = tuple(axis.get_value(bucket['key']) for axis in axes)
-            row += (bucket['doc_count'], )
-            if aggregations:
-                row += tuple(a.get_value(bucket) for a in aggregations)
-            yield row
+        for buckets in _elastic_aggregate(index, sources, query_values, filters, aggregations, runtime_mappings):
+            yield from _bucket_rows(axes, aggregations, buckets)
 
 
 def query_aggregate(index: Union[str, List[str]], axes: Sequence[Axis] = None, aggregations: Sequence[Aggregation] = None, *,
@@ -202,8 +315,11 @@ def query_aggregate(index: Union[str, List[str]], axes: Sequence[Axis] = None, a
     fields = get_fields(index)
     if not axes:
         axes = []
+    indices = [index] if isinstance(index, str) else index
     for axis in axes:
         axis.ftype = "_query" if axis.field == "_query" else fields[axis.field]['type']
+        if m := interval_mapping(axis.interval):
+            axis.persisted = all(m.is_persisted(get_date_mapping_fields(ix), axis.field) for ix in indices)
     if not aggregations:
         aggregations = []
     for aggregation in aggregations:
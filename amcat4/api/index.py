@@ -4,7 +4,7 @@ from typing import List, Literal, Mapping, Optional
 
 import elasticsearch
 from elastic_transport import ApiError
-from fastapi import APIRouter, HTTPException, Response, status
+from fastapi import APIRouter, HTTPException, Query, Response, status
 from fastapi.params import Body, Depends
 from pydantic import BaseModel, ConfigDict
 
@@ -291,9 +291,18 @@ def set_fields(
 
 
 @app_index.get("/{ix}/fields/{field}/values")
-def get_values(ix: str, field: str, _=Depends(authenticated_user)):
+def get_values(
+    ix: str,
+    field: str,
+    execution_hint: Optional[str] = Query(
+        None,
+        description="Terms execution hint. Default: map for keyword-like fields, the elastic default otherwise",
+        pattern="^(map|global_ordinals)$",
+    ),
+    _=Depends(authenticated_user),
+):
     """Get the fields (columns) used in this index."""
-    return elastic.get_values(ix, field, size=100)
+    return elastic.get_values(ix, field, size=100, execution_hint=execution_hint)
 
 
 @app_index.get("/{ix}/users")
@@ -23,6 +23,7 @@ class QueryMeta(BaseModel):
     page_count: Optional[int] = None
     page: Optional[int] = None
     scroll_id: Optional[str] = None
+    next_cursor: Optional[List[Any]] = None
 
 
 class QueryResult(BaseModel):
@@ -221,6 +222,11 @@ def query_documents_post(
     scroll_id: Optional[str] = Body(
         None, description="Scroll id from previous response to continue scrolling"
     ),
+    search_after: Optional[List[Any]] = Body(
+        None,
+        description="next_cursor from a previous (sorted) response to get the next page of results. "
+        "This is more efficient than page for deep pagination",
+    ),
     annotations: Optional[bool] = Body(
         None, description="Return _annotations with query matches as annotations"
     ),
@@ -234,9 +240,16 @@ def query_documents_post(
     """
     List or query documents in this index.
 
-    Returns a JSON object {data: [...], meta: {total_count, per_page, page_count, page|scroll_id}}
+    Returns a JSON object {data: [...], meta: {total_count, per_page, page_count, page|scroll_id, next_cursor}}
+    next_cursor is only given if sort is specified, and can be passed as search_after to get the next page
     """
     # TODO check user rights on index
+    if search_after is not None:
+        if sort is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="search_after requires a sort order")
+        if scroll is not None or scroll_id is not None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="search_after cannot be combined with scroll or scroll_id")
     # Standardize fields, queries and filters to their most versatile format
     indices = index.split(",")
     if fields:
@@ -259,6 +272,7 @@ def query_documents_post(
         page=page,
         scroll_id=scroll_id,
         scroll=scroll,
+        search_after=search_after,
         annotations=annotations,
         highlight=highlight,
     )
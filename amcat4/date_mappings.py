@@ -1,5 +1,11 @@
+import functools
 from inspect import isclass
-from typing import Optional, Iterable
+from typing import Optional, Iterable, Dict, Mapping
+
+from amcat4.elastic import DATE_MAPPING_META, es, invalidate_field_cache, update_by_query
+
+# Field metadata key that is set to "true" once all existing documents have the persisted field, see persist
+DATE_MAPPING_READY_META = "amcat4_date_mapping_ready"
 
 
 class DateMapping:
@@ -11,6 +17,63 @@ class DateMapping:
             "script": self.mapping_script(field)
         }}
 
+    def persist(self, index: str, field: str, wait_for_completion: bool = False) -> Optional[str]:
+        """
+        Add this mapping to the index as a field that is computed when a document is indexed,
+        so queries can use it directly instead of computing the runtime mapping for every query.
+        Existing documents are reindexed to fill the new field. On large indices this can take longer than
+        the elasticsearch client timeout, so by default it runs as a background task, and the field is only used
+        by queries after finish_persist has seen that the task completed (until then, the runtime mapping is used).
+        The field is marked as internal, so it is not listed in get_fields.
+        :param wait_for_completion: if True, wait until all existing documents are reindexed
+        :return: the id of the background reindexing task, or None if wait_for_completion is True
+        """
+        self._put_mapping(index, field, ready=False)
+        result = update_by_query(index, None, dict(query={"exists": {"field": field}}, conflicts="proceed"),
+                                 wait_for_completion=wait_for_completion)
+        if not wait_for_completion:
+            return result["task"]
+        self._check_failures(field, result)
+        self._put_mapping(index, field, ready=True)
+        return None
+
+    def finish_persist(self, index: str, field: str, task_id: str) -> bool:
+        """
+        Check whether the reindexing task started by persist has completed, and if so mark the field as ready
+        :return: True if the field is ready to use, False if the task is still running
+        """
+        task = es().tasks.get(task_id=task_id)
+        if not task["completed"]:
+            return False
+        if error := task.get("error"):
+            raise Exception(f"Reindexing for {self.fieldname(field)} failed: {error}")
+        self._check_failures(field, task["response"])
+        self._put_mapping(index, field, ready=True)
+        return True
+
+    def _check_failures(self, field: str, response: Mapping):
+        if failures := response.get("failures"):
+            raise Exception(f"Reindexing for {self.fieldname(field)} failed: {failures}")
+
+    def _put_mapping(self, index: str, field: str, ready: bool):
+        # The meta of an existing field can be updated in place, as long as the rest of the mapping is unchanged
+        mapping = {
+            "type": self.mapping_type(),
+            "script": {"source": self.mapping_script(field)},
+            "on_script_error": "continue",
+            "meta": {DATE_MAPPING_META: self.interval, DATE_MAPPING_READY_META: str(ready).lower()},
+        }
+        es().indices.put_mapping(index=index, properties={self.fieldname(field): mapping})
+        invalidate_field_cache(index)
+
+    def is_persisted(self, fields: Mapping[str, dict], field: str) -> bool:
+        """
+        Is this mapping persisted (see persist) and filled for all documents in the index
+        with the given date mapping fields?
+        """
+        meta = fields.get(self.fieldname(field), {}).get("meta", {})
+        return meta.get(DATE_MAPPING_META) == self.interval and meta.get(DATE_MAPPING_READY_META) == "true"
+
     def mapping_script(self, field: str) -> str:
         raise NotImplementedError()
 
@@ -35,8 +98,8 @@ class DayPart(DateMapping):
     interval = "daypart"
 
     def mapping_script(self, field):
-        return """
-            int hour =doc['date'].value.hour;
+        return f"""
+            int hour =doc['{field}'].value.hour;
             if (hour < 6) emit('Night');
             else if (hour < 12) emit('Morning');
             else if (hour < 18) emit('Afternoon');
@@ -51,7 +114,7 @@ class MonthName(DateMapping):
         return "double"
 
     def mapping_script(self, field):
-        return "emit(doc['date'].value.getMonthValue())"
+        return f"emit(doc['{field}'].value.getMonthValue())"
 
     def postprocess(self, value):
         return int(value)
@@ -64,7 +127,7 @@ class YearNr(DateMapping):
         return "double"
 
     def mapping_script(self, field):
-        return "emit(doc['date'].value.getYear())"
+        return f"emit(doc['{field}'].value.getYear())"
 
     def postprocess(self, value):
         return int(value)
@@ -77,7 +140,7 @@ class DayOfMonth(DateMapping):
         return "double"
 
     def mapping_script(self, field):
-        return "emit(doc['date'].value.getDayOfMonth())"
+        return f"emit(doc['{field}'].value.getDayOfMonth())"
 
     def postprocess(self, value):
         return int(value)
@@ -90,19 +153,22 @@ class Weeknr(DateMapping):
         return "double"
 
     def mapping_script(self, field):
-        return "emit(doc['date'].value.get(IsoFields.WEEK_OF_WEEK_BASED_YEAR))"
+        return f"emit(doc['{field}'].value.get(IsoFields.WEEK_OF_WEEK_BASED_YEAR))"
 
     def postprocess(self, value):
         return int(value)
 
 
 def interval_mapping(interval: str) -> Optional[DateMapping]:
-    for m in mappings():
-        if m.interval == interval:
-            return m
+    return _mappings_by_interval().get(interval)
 
 
 def mappings() -> Iterable[DateMapping]:
-    for c in globals().values():
-        if isclass(c) and issubclass(c, DateMapping) and c != DateMapping and c.interval is not None:
-            yield c()
+    return _mappings_by_interval().values()
+
+
+@functools.lru_cache()
+def _mappings_by_interval() -> Dict[str, DateMapping]:
+    # The mappings are stateless, so only find and instantiate them once
+    return {c.interval: c() for c in globals().values()
+            if isclass(c) and issubclass(c, DateMapping) and c != DateMapping and c.interval is not None}
@@ -11,9 +11,13 @@ Some things to note:
 """
 import functools
 import hashlib
+import itertools
 import json
 import logging
-from typing import Mapping, List, Iterable, Optional, Tuple, Union, Sequence, Literal
+import threading
+import time
+from collections import OrderedDict
+from typing import Mapping, List, Iterable, Optional, Tuple, Union, Sequence, Literal, Dict, Callable, Any
 
 from elasticsearch import Elasticsearch, NotFoundError
 from elasticsearch.helpers import bulk
@@ -44,6 +48,21 @@ DEFAULT_MAPPING = {
     "url": ES_MAPPINGS["url"],
 }
 
+# Cache of {index: (version, timestamp, fields)}, see get_index_fields.
+# Entries expire after FIELD_CACHE_TTL seconds, so changes made by other processes are picked up eventually.
+# Mapping-changing operations in this process bump the index version in FIELD_CACHE_VERSIONS,
+# so an entry is also stale if it was fetched for an older version (even if that fetch finished later)
+FIELD_CACHE: "OrderedDict[str, Tuple[int, float, Tuple[Mapping[str, dict], Mapping[str, dict]]]]" = OrderedDict()
+FIELD_CACHE_VERSIONS: Dict[str, int] = {}
+FIELD_CACHE_TTL = 5
+FIELD_CACHE_SIZE = 256
+_FIELD_CACHE_LOCK = threading.Lock()
+# Events for mappings that are currently being fetched, see get_index_fields
+_FIELD_CACHE_INFLIGHT: Dict[str, threading.Event] = {}
+
+# Field metadata key marking persisted date mapping fields, see DateMapping.persist
+DATE_MAPPING_META = "amcat4_date_mapping"
+
 SYSTEM_MAPPING = {
     "name": {"type": "text"},
     "description": {"type": "text"},
@@ -139,69 +158,73 @@ def _setup_elastic():
     return elastic
 
 
-def coerce_type_to_elastic(value, ftype):
-    """
-    Coerces values into the respective type in elastic
-    based on ES_MAPPINGS and elastic field types
-    """
-    if ftype in ["keyword", "constant_keyword", "wildcard", "url", "text"]: # Removed "tag", fucks with array of strings upload
-        value = str(value)
-    elif ftype in [
-        "long",
-        "short",
-        "byte",
-        "double",
-        "float",
-        "half_float",
-        "half_float",
-        "unsigned_long",
-    ]:
-        value = float(value)
-    elif ftype in ["integer"]:
-        value = int(value)
-    elif ftype == "boolean":
-        value = bool(value)
-    return value
+# Functions to coerce values into the respective type in elastic, based on ES_MAPPINGS and elastic field types
+# (note: "tag" is not coerced, as that breaks uploading arrays of strings)
+COERCERS: Dict[str, Callable[[Any], Any]] = {
+    **{ftype: str for ftype in ["keyword", "constant_keyword", "wildcard", "url", "text"]},
+    **{ftype: float for ftype in ["long", "short", "byte", "double", "float", "half_float", "unsigned_long"]},
+    "integer": int,
+    "boolean": bool,
+}
+
+
+# Number of documents that upload_documents coerces and sends to elastic at a time (the bulk helper default)
+UPLOAD_CHUNK_SIZE = 500
+
+# Encoder for the canonical json form of a document used in _get_hash, equivalent to
+# json.dumps(document, sort_keys=True, ensure_ascii=True, default=str) but without creating an encoder per call
+_HASH_ENCODER = json.JSONEncoder(sort_keys=True, ensure_ascii=True, default=str)
 
 
-def _get_hash(document: dict) -> bytes:
+def _get_hash(document: dict) -> str:
     """
     Get the hash for a document
+    Note that changing the way the hash is computed would change the ids of (re)uploaded documents,
+    breaking deduplication against documents that are already in an index
     """
-    hash_str = json.dumps(
-        document, sort_keys=True, ensure_ascii=True, default=str
-    ).encode("ascii")
-    m = hashlib.sha224()
-    m.update(hash_str)
-    return m.hexdigest()
+    hash_str = _HASH_ENCODER.encode(document).encode("ascii")
+    return hashlib.sha224(hash_str).hexdigest()
 
 
 def upload_documents(index: str, documents, fields: Mapping[str, str] = None) -> None:
     """
     Upload documents to this index
 
+    Documents are coerced and sent in chunks of UPLOAD_CHUNK_SIZE, and a chunk is only sent after all its documents
+    are coerced. If a document has a value that cannot be coerced to its field type (e.g. "abc" for a long field),
+    a ValueError is raised and nothing from its chunk is indexed, but earlier chunks will already have been indexed.
+
     :param index: The name of the index (without prefix)
-    :param documents: A sequence of article dictionaries
+    :param documents: A sequence of article dictionaries.
+                      Note that the dictionaries are used as bulk actions, i.e. they are modified in place
     :param fields: A mapping of field:type for field types
     """
 
     def es_actions(index, documents):
         field_types = get_index_fields(index)
+        coercers = {field: COERCERS[spec["type"]] for (field, spec) in field_types.items()
+                    if spec.get("type") in COERCERS}
         for document in documents:
             for key in document.keys():
-                if key in field_types:
-                    document[key] = coerce_type_to_elastic(
-                        document[key], field_types[key].get("type")
-                    )
+                if coerce := coercers.get(key):
+                    document[key] = coerce(document[key])
             if "_id" not in document:
                 document["_id"] = _get_hash(document)
-            yield {"_index": index, **document}
+            document["_index"] = index
+            yield document
 
     if fields:
         set_fields(index, fields)
 
-    actions = list(es_actions(index, documents))
-    bulk(es(), actions)
+    actions = es_actions(index, documents)
+    try:
+        # Don't materialize all actions in memory, but coerce a whole chunk before sending it,
+        # so a chunk is never partially indexed
+        while chunk := list(itertools.islice(actions, UPLOAD_CHUNK_SIZE)):
+            bulk(es(), chunk, chunk_size=UPLOAD_CHUNK_SIZE)
+    finally:
+        # New fields may have been added by dynamic mapping, even if (part of) the upload failed
+        invalidate_field_cache(index)
 
 
 def get_field_mapping(type_: Union[str, dict]):
@@ -225,6 +248,7 @@ def set_fields(index: str, fields: Mapping[str, str]):
     """
     properties = {field: get_field_mapping(type_) for (field, type_) in fields.items()}
     es().indices.put_mapping(index=index, properties=properties)
+    invalidate_field_cache(index)
 
 
 def get_document(index: str, doc_id: str, **kargs) -> dict:
@@ -248,6 +272,7 @@ def update_document(index: str, doc_id: str, fields: dict):
     """
     # Mypy doesn't understand that body= has been deprecated already...
     es().update(index=index, id=doc_id, doc=fields)  # type: ignore
+    invalidate_field_cache(index)
 
 
 def delete_document(index: str, doc_id: str):
@@ -283,10 +308,70 @@ def _get_fields(index: str) -> Iterable[Tuple[str, dict]]:
 def get_index_fields(index: str) -> Mapping[str, dict]:
     """
     Get the field types in use in this index
+    Results are cached for FIELD_CACHE_TTL seconds, see invalidate_field_cache
     :param index:
     :return: a dict of fieldname: field objects {fieldname: {name, type, meta, ...}]
     """
-    return dict(_get_fields(index))
+    return _get_cached_fields(index)[0]
+
+
+def get_date_mapping_fields(index: str) -> Mapping[str, dict]:
+    """
+    Get the persisted date mapping fields in this index (see DateMapping.persist).
+    These are internal fields, so they are not included in get_index_fields
+    :param index:
+    :return: a dict of fieldname: field objects {fieldname: {name, type, meta, ...}]
+    """
+    return _get_cached_fields(index)[1]
+
+
+def _get_cached_fields(index: str) -> Tuple[Mapping[str, dict], Mapping[str, dict]]:
+    """
+    Get the (normal fields, date mapping fields) of this index from the cache, fetching them if needed
+    """
+    while True:
+        with _FIELD_CACHE_LOCK:
+            version = FIELD_CACHE_VERSIONS.get(index, 0)
+            if cached := FIELD_CACHE.get(index):
+                cached_version, timestamp, fields = cached
+                if cached_version == version and time.monotonic() - timestamp < FIELD_CACHE_TTL:
+                    FIELD_CACHE.move_to_end(index)
+                    return fields
+            # Only one thread fetches the mapping, other threads wait for it and then check the cache again
+            if inflight := _FIELD_CACHE_INFLIGHT.get(index):
+                fetch = False
+            else:
+                inflight = _FIELD_CACHE_INFLIGHT[index] = threading.Event()
+                fetch = True
+        if not fetch:
+            inflight.wait()
+            continue
+        try:
+            timestamp = time.monotonic()
+            fetched: Tuple[Dict[str, dict], Dict[str, dict]] = ({}, {})
+            for name, field in _get_fields(index):
+                fetched[1 if field.get("meta", {}).get(DATE_MAPPING_META) else 0][name] = field
+            with _FIELD_CACHE_LOCK:
+                # Don't overwrite an entry for a newer version if another thread was faster
+                if not (cached := FIELD_CACHE.get(index)) or cached[0] <= version:
+                    FIELD_CACHE[index] = (version, timestamp, fetched)
+                    FIELD_CACHE.move_to_end(index)
+                    while len(FIELD_CACHE) > FIELD_CACHE_SIZE:
+                        FIELD_CACHE.popitem(last=False)
+            return fetched
+        finally:
+            with _FIELD_CACHE_LOCK:
+                del _FIELD_CACHE_INFLIGHT[index]
+            inflight.set()
+
+
+def invalidate_field_cache(index: Union[str, Sequence[str]]):
+    """
+    Mark the cached fields for this index or indices as stale, e.g. after changing the mapping
+    """
+    with _FIELD_CACHE_LOCK:
+        for ix in [index] if isinstance(index, str) else index:
+            FIELD_CACHE_VERSIONS[ix] = FIELD_CACHE_VERSIONS.get(ix, 0) + 1
 
 
 def get_fields(index: Union[str, Sequence[str]]):
@@ -308,21 +393,48 @@ def get_fields(index: Union[str, Sequence[str]]):
     return result
 
 
-def get_values(index: str, field: str, size: int = 100) -> List[str]:
+# Field types for which get_values uses the 'map' execution hint by default
+MAP_HINT_TYPES = {"keyword", "tag", "url", "id"}
+
+
+def get_values(index: str, field: str, size: int = 100, execution_hint: Optional[str] = None) -> List[str]:
     """
     Get the values for a given field (e.g. to populate list of filter values on keyword field)
-    :param index: The index
+    :param index: The index, or a comma separated list of indices
     :param field: The field name
+    :param execution_hint: terms execution hint ('map' or 'global_ordinals'). If None, 'map' is used for keyword-like
+                           fields, which avoids building global ordinals and is faster for low/medium cardinality
+                           fields, and the elastic default otherwise.
     :return: A list of values
     """
-    aggs = {"values": {"terms": {"field": field}}}
+    if execution_hint is None:
+        try:
+            field_type = get_fields(index.split(",")).get(field, {}).get("type")
+        except KeyError:
+            # e.g. an alias, for which the mapping is returned under the concrete index name: use the elastic default
+            field_type = None
+        if field_type in MAP_HINT_TYPES:
+            execution_hint = "map"
+    terms = {"field": field}
+    if execution_hint:
+        terms["execution_hint"] = execution_hint
+    aggs = {"values": {"terms": terms}}
     r = es().search(index=index, size=size, aggs=aggs)
     return [x["key"] for x in r["aggregations"]["values"]["buckets"]]
 
 
-def update_by_query(index: str, script: str, query: dict, params: dict = None):
-    script = dict(source=script, lang="painless", params=params or {})
-    es().update_by_query(index=index, script=script, **query)
+def update_by_query(index: str, script: Optional[str], query: dict, params: dict = None, **kwargs) -> dict:
+    """
+    Run the (painless) script on all documents matching the query.
+    If script is None, the documents are reindexed without changes (e.g. to fill newly added scripted fields)
+    :param kwargs: extra arguments for elasticsearch update_by_query, e.g. wait_for_completion
+    :return: the elasticsearch response, containing the task id if wait_for_completion=False
+    """
+    if script is not None:
+        query = dict(query, script=dict(source=script, lang="painless", params=params or {}))
+    result = es().update_by_query(index=index, **query, **kwargs)
+    invalidate_field_cache(index)
+    return result
 
 
 TAG_SCRIPTS = dict(
@@ -37,7 +37,7 @@ import elasticsearch.helpers
 from elasticsearch import NotFoundError
 
 from amcat4.config import get_settings
-from amcat4.elastic import DEFAULT_MAPPING, es, get_fields
+from amcat4.elastic import DEFAULT_MAPPING, es, get_fields, invalidate_field_cache
 
 
 class Role(IntEnum):
@@ -131,6 +131,7 @@ def create_index(
     Create a new index in elasticsearch and register it with this AmCAT instance
     """
     es().indices.create(index=index, mappings={"properties": DEFAULT_MAPPING})
+    invalidate_field_cache(index)
     register_index(
         index, guest_role=guest_role, name=name, description=description, admin=admin
     )
@@ -174,6 +175,7 @@ def delete_index(index: str, ignore_missing=False) -> None:
     deregister_index(index, ignore_missing=ignore_missing)
     _es = es().options(ignore_status=404) if ignore_missing else es()
     _es.indices.delete(index=index)
+    invalidate_field_cache(index)
 
 
 def deregister_index(index: str, ignore_missing=False) -> None:
@@ -10,7 +10,7 @@ from .date_mappings import mappings
 from .elastic import es, update_tag_by_query
 
 
-def build_body(queries: Iterable[str] = None, filters: Mapping = None, highlight: Union[bool, dict] = False,
+def build_body(queries: Sequence[str] = None, filters: Mapping = None, highlight: Union[bool, dict] = False,
                ids: Iterable[str] = None):
     def parse_filter(field, filter) -> Tuple[Mapping, Mapping]:
         filter = filter.copy()
@@ -45,7 +45,7 @@ def build_body(queries: Iterable[str] = None, filters: Mapping = None, highlight
 
     def parse_queries(qs: Sequence[str]) -> dict:
         if len(qs) == 1:
-            return parse_query(list(qs)[0])
+            return parse_query(qs[0])
         else:
             return {"bool": {"should": [parse_query(q) for q in qs]}}
     if not (queries or filters or ids):
@@ -58,9 +58,7 @@ def build_body(queries: Iterable[str] = None, filters: Mapping = None, highlight
             if extra_runtime_mappings:
                 runtime_mappings.update(extra_runtime_mappings)
     if queries:
-        if isinstance(queries, dict):
-            queries = queries.values()
-        fs.append(parse_queries(list(queries)))
+        fs.append(parse_queries(queries))
     if ids:
         fs.append({"ids": {"values": list(ids)}})
     body: Dict[str, Any] = {"query": {"bool": {"filter": fs}}}
@@ -78,7 +76,8 @@ def build_body(queries: Iterable[str] = None, filters: Mapping = None, highlight
 
 class QueryResult:
     def __init__(self, data: List[dict],
-                 n: int = None, per_page: int = None, page: int = None, page_count: int = None, scroll_id: str = None):
+                 n: int = None, per_page: int = None, page: int = None, page_count: int = None, scroll_id: str = None,
+                 next_cursor: List[Any] = None):
         if n and (page_count is None) and (per_page is not None):
             page_count = ceil(n / per_page)
         self.data = data
@@ -87,6 +86,7 @@ class QueryResult:
         self.page_count = page_count
         self.per_page = per_page
         self.scroll_id = scroll_id
+        self.next_cursor = next_cursor
 
     def as_dict(self):
         meta = {"total_count": self.total_count,
@@ -97,6 +97,8 @@ class QueryResult:
             meta['scroll_id'] = self.scroll_id
         else:
             meta['page'] = self.page
+        if self.next_cursor is not None:
+            meta['next_cursor'] = self.next_cursor
         return dict(meta=meta, results=self.data)
 
 
@@ -114,12 +116,15 @@ def query_documents(index: Union[str, Sequence[str]], queries: Union[Mapping[str
                     filters: Mapping[str, Mapping] = None,
                     highlight: Union[bool, dict] = False, annotations=False,
                     sort: List[Union[str, Mapping]] = None,
+                    search_after: List[Any] = None,
                     **kwargs) -> Optional[QueryResult]:
     """
     Conduct a query_string query, returning the found documents.
 
     It will return at most per_page results.
     In normal (paginated) mode, the next batch can be  requested by incrementing the page parameter.
+    If a sort order is given, the result also contains a next_cursor which can be passed as search_after to get
+    the next batch. This is more efficient than using page for deep pagination.
     If the scroll parameter is given, the result will contain a scroll_id which can be used to get the next batch.
     In case there are no more documents to scroll, it will return None
     :param index: The name of the index or indexes
@@ -142,26 +147,35 @@ def query_documents(index: Union[str, Sequence[str]], queries: Union[Mapping[str
     :param sort: Sort order of results, can be either a single field or a list of fields.
                  In the list, each field is a string or a dict with options, e.g. ["id", {"date": {"order": "desc"}}]
                  (https://www.elastic.co/guide/en/elasticsearch/reference/current/sort-search-results.html)
+    :param search_after: if not None, the next_cursor of a previous result to get the hits after that result
+                         (instead of using page). Requires sort, which should end with a unique field as tie breaker.
     :param kwargs: Additional elements passed to Elasticsearch.search()
     :return: a QueryResult, or None if there is not scroll result anymore
     """
+    if search_after is not None:
+        if sort is None:
+            raise ValueError("search_after requires a sort order")
+        if scroll or scroll_id:
+            raise ValueError("search_after cannot be combined with scroll or scroll_id")
     if scroll or scroll_id:
         # set scroll to default also if scroll_id is given but no scroll time is known
         kwargs['scroll'] = '2m' if (not scroll or scroll is True) else scroll
     queries = _normalize_queries(queries)
     if sort is not None:
         kwargs["sort"] = sort
+    if search_after is not None:
+        kwargs["search_after"] = search_after
     if scroll_id:
         result = es().scroll(scroll_id=scroll_id, **kwargs)
         if not result['hits']['hits']:
             return None
     else:
-        body = build_body(queries.values(), filters, highlight)
+        body = build_body(list(queries.values()), filters, highlight)
 
         if fields:
             fields = fields if isinstance(fields, list) else list(fields)
             kwargs['_source'] = fields
-        if not scroll:
+        if not scroll and search_after is None:
             kwargs['from_'] = page * per_page
         result = es().search(index=index, size=per_page, **body, **kwargs)
 
@@ -180,7 +194,10 @@ def query_documents(index: Union[str, Sequence[str]], queries: Union[Mapping[str
     elif scroll:
         return QueryResult(data, n=result['hits']['total']['value'], per_page=per_page, scroll_id=result['_scroll_id'])
     else:
-        return QueryResult(data, n=result['hits']['total']['value'], per_page=per_page,  page=page)
+        hits = result['hits']['hits']
+        next_cursor = hits[-1]['sort'] if sort is not None and hits else None
+        return QueryResult(data, n=result['hits']['total']['value'], per_page=per_page,  page=page,
+                           next_cursor=next_cursor)
 
 
 def query_annotations(index: str, id: str, queries: Mapping[str,  str]) -> Iterable[Dict]:
@@ -238,5 +255,5 @@ def update_tag_query(index: Union[str, Sequence[str]], action: Literal["add", "r
                      filters: Mapping[str, Mapping] = None,
                      ids: Sequence[str] = None):
     """Add or remove tags using a query"""
-    body = build_body(queries and queries.values(), filters, ids=ids)
+    body = build_body(list(_normalize_queries(queries).values()), filters, ids=ids)
     update_tag_by_query(index, action, body, field, tag)
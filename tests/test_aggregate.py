@@ -1,7 +1,12 @@
 import functools
+import time
 from datetime import datetime, date
 
+from amcat4 import elastic
 from amcat4.aggregate import query_aggregate, Axis, Aggregation
+from amcat4.date_mappings import interval_mapping, mappings
+from amcat4.elastic import get_fields
+from amcat4.index import refresh_index
 from tests.conftest import upload
 from tests.tools import dictset
 
@@ -109,3 +114,71 @@ def test_aggregate_datefunctions(index: str):
     assert q(Axis("date", interval="weeknr")) == {1: 2, 2: 1, 3: 2, 10: 1}
     assert q(Axis("date", interval="month"), Axis("date", interval="dayofmonth")) == {
         (date(2018, 1, 1), 1): 2, (date(2018, 1, 1), 11): 1, (date(2018, 1, 1), 17): 2, (date(2018, 3, 1), 7): 1}
+
+
+def test_byquery_metric(index_docs: str):
+    """Can we combine a query axis with metric aggregations"""
+    result = query_aggregate(index_docs, [Axis("_query")], [Aggregation("i", "max")], queries=["text", "test*"])
+    assert dictset(result.as_dicts()) == dictset([{"_query": "text", "n": 2, "max_i": 2.0},
+                                                  {"_query": "test*", "n": 3, "max_i": 31.0}])
+    result = query_aggregate(index_docs, [Axis("_query"), Axis("subcat")], [Aggregation("i", "max")],
+                             queries=["text", "test*"])
+    assert dictset(result.as_dicts()) == dictset([{"_query": "text", "subcat": "x", "n": 2, "max_i": 2.0},
+                                                  {"_query": "test*", "subcat": "x", "n": 1, "max_i": 2.0},
+                                                  {"_query": "test*", "subcat": "y", "n": 2, "max_i": 31.0}])
+
+
+def test_aggregate_persisted_datefunctions(index: str):
+    """Do date function axes work if the mapping is persisted in the index"""
+    q = functools.partial(do_query, index)
+    upload(index, [dict(date=x) for x in ["2018-01-01T04:00:00", "2018-01-17T11:00:00"]])
+    interval_mapping("dayofweek").persist(index, "date", wait_for_completion=True)
+    refresh_index(index)
+    assert "date_dayofweek" not in get_fields(index)
+    assert elastic.get_date_mapping_fields(index)["date_dayofweek"]["type"] == "keyword"
+    axis = Axis("date", interval="dayofweek")
+    assert q(axis) == {"Monday": 1, "Wednesday": 1}
+    assert axis.persisted and axis.runtime_mappings() is None
+    # New documents should get the field at index time
+    elastic.upload_documents(index, [dict(date="2018-01-18T11:00:00", title="new", text="new")])
+    refresh_index(index)
+    assert q(axis) == {"Monday": 1, "Wednesday": 1, "Thursday": 1}
+
+
+def test_aggregate_persist_background(index: str):
+    """Are aggregations correct while a persisted date mapping is still being filled in the background"""
+    q = functools.partial(do_query, index)
+    upload(index, [dict(date=x) for x in ["2018-01-01T04:00:00", "2018-01-17T11:00:00"]])
+    mapping = interval_mapping("dayofweek")
+    task = mapping.persist(index, "date")
+    assert task is not None
+    # Until finish_persist has seen the task complete, the runtime mapping should be used
+    axis = Axis("date", interval="dayofweek")
+    assert q(axis) == {"Monday": 1, "Wednesday": 1}
+    assert not axis.persisted
+    for _ in range(100):
+        if mapping.finish_persist(index, "date", task):
+            break
+        time.sleep(0.1)
+    else:
+        raise AssertionError("Reindexing task did not complete")
+    refresh_index(index)
+    axis = Axis("date", interval="dayofweek")
+    assert q(axis) == {"Monday": 1, "Wednesday": 1}
+    assert axis.persisted
+
+
+def test_date_mapping_scripts_use_field():
+    """Do the date mapping scripts refer to the given field rather than a fixed one"""
+    for m in mappings():
+        script = m.mapping_script("published")
+        assert "doc['published']" in script and "doc['date']" not in script
+
+
+def test_aggregate_pagination(index_many: str):
+    """Do we get all buckets if the composite aggregation needs multiple pages (default page size is 10)"""
+    assert do_query(index_many, Axis("id")) == {i: 1 for i in range(20)}
+    queries = {"odd": "odd", "all": "odd OR even"}
+    expected = {**{("odd", i): 1 for i in range(0, 20, 2)}, **{("all", i): 1 for i in range(20)}}
+    assert do_query(index_many, Axis("_query"), Axis("id"), queries=queries) == expected
+    assert do_query(index_many, Axis("id"), Axis("_query"), queries=queries) == {(i, q): n for ((q, i), n) in expected.items()}
@@ -99,6 +99,22 @@ def test_query_post(client, index_docs, user):
     assert set(q(fields=["date", "title"])[0].keys()) == {"_id", "date", "title"}
 
 
+def test_query_post_search_after(client, index_docs, user):
+    """Can we paginate with the next_cursor of a sorted query, and are invalid combinations refused?"""
+    url = f"/index/{index_docs}/query"
+    r = post_json(client, url, user=user, expected=200, json=dict(sort="i", per_page=2, fields=["i"]))
+    assert [d["i"] for d in r["results"]] == [1, 2]
+    assert r["meta"]["next_cursor"] == [2]
+    body = dict(sort="i", per_page=2, fields=["i"], search_after=r["meta"]["next_cursor"])
+    r = post_json(client, url, user=user, expected=200, json=body)
+    assert [d["i"] for d in r["results"]] == [11, 31]
+    assert "next_cursor" not in post_json(client, url, user=user, expected=200)["meta"]
+
+    post_json(client, url, user=user, expected=400, json=dict(search_after=[2]))
+    post_json(client, url, user=user, expected=400, json=dict(sort="i", search_after=[2], scroll="5m"))
+    post_json(client, url, user=user, expected=400, json=dict(sort="i", search_after=[2], scroll_id="x"))
+
+
 def test_aggregate(client, index_docs, user):
     r = post_json(
         client,
@@ -1,4 +1,9 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from unittest import mock
+
+import pytest
 
 from amcat4 import elastic
 from amcat4.elastic import get_fields
@@ -33,6 +38,24 @@ def test_data_coerced(index):
     assert isinstance(d["title"], str)
 
 
+def test_upload_invalid_value(index, monkeypatch):
+    """Does a value that cannot be coerced fail its whole chunk, but keep earlier chunks?"""
+    elastic.set_fields(index, {"i": "long"})
+
+    def docs():
+        return [dict(text="text", title="valid", date="2022-12-13", i="1"),
+                dict(text="text", title="invalid", date="2022-12-13", i="abc")]
+    with pytest.raises(ValueError):
+        elastic.upload_documents(index, docs())
+    refresh_index(index)
+    assert query_documents(index, fields=["title"]).total_count == 0
+    monkeypatch.setattr(elastic, "UPLOAD_CHUNK_SIZE", 1)
+    with pytest.raises(ValueError):
+        elastic.upload_documents(index, docs())
+    refresh_index(index)
+    assert [d["title"] for d in query_documents(index, fields=["title"]).data] == ["valid"]
+
+
 def test_fields(index):
     """Can we get the fields from an index"""
     fields = get_fields(index)
@@ -40,12 +63,81 @@ def test_fields(index):
     assert fields['date']['type'] == "date"
 
 
+def test_fields_cache(index):
+    """Are new fields visible right away, even though fields are cached"""
+    assert "x" not in get_fields(index)
+    elastic.set_fields(index, {"x": "keyword"})
+    assert get_fields(index)["x"]["type"] == "keyword"
+    elastic.upload_documents(index, [dict(title="title", text="text", date="2020-01-01", y=1)])
+    assert get_fields(index)["y"]["type"] == "long"
+
+
+def test_fields_cache_invalidated_during_fetch(index, monkeypatch):
+    """A mapping that was fetched before the cache was invalidated should not be served afterwards"""
+    get_fields_from_elastic = elastic._get_fields
+    calls = []
+
+    def fetch(ix):
+        calls.append(ix)
+        result = list(get_fields_from_elastic(ix))
+        if len(calls) == 1:
+            # simulate another thread changing the mapping while we are fetching it
+            elastic.set_fields(ix, {"x": "keyword"})
+        return result
+    monkeypatch.setattr(elastic, "_get_fields", fetch)
+    elastic.invalidate_field_cache(index)
+    assert "x" not in get_fields(index)
+    assert "x" in get_fields(index)
+    assert len(calls) == 2
+
+
+def test_fields_cache_concurrent(index, monkeypatch):
+    """Do concurrent requests for an uncached mapping fetch it only once"""
+    client = mock.MagicMock(wraps=elastic.es())
+    get_mapping = elastic.es().indices.get_mapping
+
+    def slow_get_mapping(**kargs):
+        time.sleep(0.2)
+        return get_mapping(**kargs)
+    client.indices.get_mapping.side_effect = slow_get_mapping
+    monkeypatch.setattr(elastic, "es", lambda: client)
+    elastic.invalidate_field_cache(index)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: get_fields(index), range(8)))
+    assert client.indices.get_mapping.call_count == 1
+    assert all(r == results[0] for r in results) and "text" in results[0]
+
+
 def test_values(index):
     """Can we get values for a specific field"""
     upload(index, [dict(bla=x) for x in ["odd", "even", "even"] * 10], fields={"bla": "keyword"})
     assert set(elastic.get_values(index, "bla")) == {"odd", "even"}
 
 
+def test_values_multiple_index(index, index_docs):
+    """Can we get values for a field from multiple indices or an alias"""
+    upload(index, [dict(cat="c")], fields={"cat": "keyword"})
+    assert set(elastic.get_values(f"{index},{index_docs}", "cat")) == {"a", "b", "c"}
+    elastic.es().indices.put_alias(index=index, name=f"{index}_alias")
+    assert set(elastic.get_values(f"{index}_alias", "cat")) == {"c"}
+
+
+def test_values_execution_hint(index, monkeypatch):
+    """Is the map execution hint only used for keyword-like fields, unless overridden"""
+    upload(index, [dict(bla=x, i=i) for (i, x) in enumerate(["odd", "even", "even"])],
+           fields={"bla": "keyword", "i": "long"})
+    client = mock.MagicMock(wraps=elastic.es())
+    monkeypatch.setattr(elastic, "es", lambda: client)
+
+    def hint(field, **kargs):
+        elastic.get_values(index, field, **kargs)
+        return client.search.call_args.kwargs["aggs"]["values"]["terms"].get("execution_hint")
+    assert hint("bla") == "map"
+    assert hint("i") is None
+    assert hint("bla", execution_hint="global_ordinals") == "global_ordinals"
+    assert hint("i", execution_hint="map") == "map"
+
+
 def test_update(index_docs):
     """Can we update a field on a document?"""
     assert elastic.get_document(index_docs, '0', _source=['annotations']) == {}
@@ -85,3 +177,9 @@ def test_deduplication(index):
     elastic.upload_documents(index, [doc])
     refresh_index(index)
     assert query_documents(index).total_count == 1
+
+
+def test_hash_stable():
+    """Document ids should not change between versions, otherwise deduplication breaks"""
+    doc = {"title": "titel", "text": "text", "date": datetime(2020, 1, 1)}
+    assert elastic._get_hash(doc) == "cfd02d0ead9cc73efe6166d67ea1ea66afaaa366a7b0b337781d2df3"
@@ -44,3 +44,12 @@ def test_scroll(index_many):
     r = query_documents(index_many, scroll_id=r.scroll_id)
     assert r is None
     assert {int(h['_id']) for h in allids} == {0, 2, 4, 6, 8, 10, 12, 14, 16, 18}
+
+
+def test_search_after(index_many):
+    r = query_documents(index_many, per_page=8, sort=['pagenr', 'id'])
+    allids = [int(h['_id']) for h in r.data]
+    while r.next_cursor:
+        r = query_documents(index_many, per_page=8, sort=['pagenr', 'id'], search_after=r.next_cursor)
+        allids += [int(h['_id']) for h in r.data]
+    assert allids == [int(h['_id']) for h in query_documents(index_many, per_page=20, sort=['pagenr', 'id']).data]